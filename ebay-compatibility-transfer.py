@@ -1,6 +1,7 @@
 import requests
 import re
 import html
+from item_copier import check_compatibility_list
 
 # eBay API Configuration
 EBAY_API_URL = "https://api.ebay.com/ws/api.dll"
@@ -48,12 +49,24 @@ def get_compatibility_list(source_item_id):
         
         # Fix special characters in the compatibility list
         compatibility_list = html.unescape(compatibility_list)
-        
-        return compatibility_list
-        
+
+        # Category of the source item, needed to validate the compatibility properties
+        category_match = re.search(r'<PrimaryCategory>\s*<CategoryID>(\d+)</CategoryID>', response_content)
+        category_id = category_match.group(1) if category_match else None
+
+        return compatibility_list, category_id
+
     except Exception as e:
         print(f"Fehler beim Abrufen der Compatibility List: {str(e)}")
-        return None
+        return None, None
+
+def parse_compatibility_list(compatibility_list):
+    """Parse the compatibility XML into a list of {Name: Value} dicts, one per vehicle"""
+    vehicles = []
+    for compatibility in re.findall(r'<Compatibility>(.*?)</Compatibility>', compatibility_list, re.S):
+        pairs = re.findall(r'<Name>(.*?)</Name>\s*<Value>(.*?)</Value>', compatibility, re.S)
+        vehicles.append(dict(pairs))
+    return vehicles
 
 def transfer_compatibility_list(target_item_id, compatibility_list):
     """Transfer compatibility list to target item"""
@@ -102,10 +115,16 @@ def main():
     target_item_id = input("Bitte geben Sie die Ziel-Item-ID ein: ")
     
     print("\nHole Compatibility List von Item", source_item_id, "...")
-    compatibility_list = get_compatibility_list(source_item_id)
-    
+    compatibility_list, category_id = get_compatibility_list(source_item_id)
+
     if compatibility_list:
         print("Compatibility List erfolgreich geholt!")
+
+        # Validate against the cached compatibility properties of the category
+        if category_id and not check_compatibility_list(category_id, parse_compatibility_list(compatibility_list)):
+            print("Übertragung abgebrochen aufgrund ungültiger Compatibility List.")
+            return
+
         print("\nÜbertrage Compatibility List zu Item", target_item_id, "...")
         transfer_compatibility_list(target_item_id, compatibility_list)
     else:
@@ -1,11 +1,15 @@
 import os
 import json
+import re
 import time  # Added missing import for time.time() used in create_new_item_draft
 from ebaysdk.trading import Connection as Trading
 from ebaysdk.exception import ConnectionError
 from dotenv import load_dotenv
 import html
-from collections import defaultdict
+import hashlib
+import requests
+import tempfile
+from collections import defaultdict, OrderedDict
 
 def get_item_details(item_id):
     """Ruft die eBay-Item-Details ab und speichert sie in einer Datei."""
@@ -120,6 +124,258 @@ def extract_picture_url(item):
     
     return None
 
+def fetch_category_version():
+    """
+    Ruft die aktuelle Kategorie-Version der Website ab (GetCategories ohne DetailLevel).
+
+    Das Ergebnis wird pro Programmlauf nur einmal abgefragt.
+    """
+    global _category_version
+    if _category_version is not None:
+        return _category_version
+
+    try:
+        api = Trading(config_file=None, **EBAY_API_CONFIG)
+        response = api.execute('GetCategories', {'CategorySiteID': EBAY_API_CONFIG['siteid']})
+        _category_version = str(response.reply.CategoryVersion)
+    except ConnectionError as e:
+        print(f"Fehler beim Abrufen der Kategorie-Version: {e}")
+        return None
+
+    return _category_version
+
+def fetch_category_specifics(category_id):
+    """Ruft die erlaubten Item-Specifics einer Kategorie über GetCategorySpecifics ab."""
+    api = Trading(config_file=None, **EBAY_API_CONFIG)
+    response = api.execute('GetCategorySpecifics', {
+        'CategoryID': category_id,
+        'MaxNames': 30,
+        'MaxValuesPerName': 2147483647
+    })
+
+    specifics = {}
+    recommendations = response.dict().get('Recommendations') or {}
+    name_recommendations = recommendations.get('NameRecommendation') or []
+    if isinstance(name_recommendations, dict):
+        name_recommendations = [name_recommendations]
+
+    for recommendation in name_recommendations:
+        rules = recommendation.get('ValidationRules') or {}
+        values = recommendation.get('ValueRecommendation') or []
+        if isinstance(values, dict):
+            values = [values]
+
+        specifics[recommendation['Name']] = {
+            'UsageConstraint': rules.get('UsageConstraint', 'Optional'),
+            'SelectionMode': rules.get('SelectionMode', 'FreeText'),
+            'MaxValues': int(rules.get('MaxValuesPerName', 1)),
+            'Values': [v['Value'] for v in values if v.get('Value')]
+        }
+    return specifics
+
+def fetch_compatibility_properties(category_id):
+    """
+    Ruft die Namen der Kompatibilitätseigenschaften (Make, Model, ...) einer Kategorie ab.
+
+    Nutzt die Taxonomy-API und benötigt daher EBAY_OAUTH_TOKEN. Ohne Token oder bei einem
+    Fehler wird None zurückgegeben und die Prüfung der Kompatibilitätsliste übersprungen.
+    """
+    if not EBAY_OAUTH_TOKEN:
+        return None
+
+    url = (f"https://api.ebay.com/commerce/taxonomy/v1/category_tree/{EBAY_API_CONFIG['siteid']}"
+           f"/get_compatibility_properties")
+    headers = {"Authorization": f"Bearer {EBAY_OAUTH_TOKEN}"}
+
+    try:
+        response = requests.get(url, headers=headers, params={'category_id': category_id},
+                                timeout=TAXONOMY_API_TIMEOUT)
+        if response.status_code == 204:
+            # Kategorie unterstützt keine Fahrzeugkompatibilität
+            return []
+        response.raise_for_status()
+        return [prop['name'] for prop in response.json().get('compatibilityProperties', [])]
+    except (requests.RequestException, ValueError) as e:
+        print(f"Fehler beim Abrufen der Kompatibilitätseigenschaften: {e}")
+        return None
+
+def save_category_metadata(category_id, metadata):
+    """Speichert die Kategorie-Metadaten im Datei-Cache."""
+    file_name = os.path.join(CATEGORY_CACHE_DIR, f"category_{category_id}.json")
+    try:
+        os.makedirs(CATEGORY_CACHE_DIR, exist_ok=True)
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4, ensure_ascii=False)
+    except Exception as e:
+        print(f"Fehler beim Speichern des Kategorie-Caches: {e}")
+
+def get_category_metadata(category_id, force_refresh=False):
+    """
+    Liefert die Metadaten (Item-Specifics, Kompatibilitätseigenschaften) einer Kategorie.
+
+    Reihenfolge: Speicher-Cache, dann Datei-Cache, dann eBay-API. Ein Cache-Eintrag wird
+    neu geladen, wenn sich die Kategorie-Version bei eBay geändert hat, wenn er älter als
+    CATEGORY_CACHE_MAX_AGE ist oder wenn force_refresh gesetzt ist. Jede Kategorie wird
+    höchstens einmal pro Programmlauf von eBay geladen, danach gilt der Speicher-Cache.
+    Ist eBay nicht erreichbar, werden vorhandene Cache-Daten trotzdem verwendet.
+    Fehlende Kompatibilitätseigenschaften werden nachgeladen, sobald ein Token vorhanden ist.
+    """
+    category_id = str(category_id)
+    if category_id in _refreshed_categories:
+        force_refresh = False
+    metadata = _category_metadata_cache.get(category_id)
+    from_memory = metadata is not None
+
+    file_name = os.path.join(CATEGORY_CACHE_DIR, f"category_{category_id}.json")
+    if metadata is None and os.path.exists(file_name):
+        try:
+            with open(file_name, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except Exception as e:
+            print(f"Fehler beim Laden des Kategorie-Caches {file_name}: {e}")
+
+    current_version = fetch_category_version()
+    if metadata is not None and not force_refresh:
+        is_fresh = time.time() - metadata.get('FetchedAt', 0) < CATEGORY_CACHE_MAX_AGE
+        if current_version is None or (metadata.get('Version') == current_version and is_fresh):
+            if not from_memory and metadata.get('CompatibilityProperties') is None and EBAY_OAUTH_TOKEN:
+                metadata['CompatibilityProperties'] = fetch_compatibility_properties(category_id)
+                if metadata['CompatibilityProperties'] is not None:
+                    save_category_metadata(category_id, metadata)
+            _category_metadata_cache[category_id] = metadata
+            return metadata
+
+    print(f"Lade Metadaten für Kategorie {category_id}...")
+    _refreshed_categories.add(category_id)
+    try:
+        specifics = fetch_category_specifics(category_id)
+    except ConnectionError as e:
+        print(f"Fehler beim Abrufen der Kategorie-Metadaten: {e}")
+        return metadata
+
+    metadata = {
+        'Version': current_version,
+        'FetchedAt': time.time(),
+        'Specifics': specifics,
+        'CompatibilityProperties': fetch_compatibility_properties(category_id)
+    }
+    _category_metadata_cache[category_id] = metadata
+    save_category_metadata(category_id, metadata)
+
+    return metadata
+
+def validate_item_specifics(category_id, item_specifics, force_refresh=False):
+    """
+    Prüft Item-Specifics (Ausgabe von extract_item_specific) gegen die Kategorie-Metadaten.
+
+    Returns:
+        Liste mit Fehlermeldungen, leer wenn alles gültig ist
+    """
+    metadata = get_category_metadata(category_id, force_refresh)
+    if not metadata:
+        return []
+
+    allowed = metadata['Specifics']
+    errors = []
+    present = set()
+
+    for spec in item_specifics:
+        name = html.unescape(spec['Name'])
+        values = spec['Value'] if isinstance(spec['Value'], list) else [spec['Value']]
+        values = [html.unescape(v) for v in values]
+        present.add(name)
+
+        if len(name) > MAX_SPECIFIC_LENGTH:
+            errors.append(f"Name '{name}' ist länger als {MAX_SPECIFIC_LENGTH} Zeichen")
+        for value in values:
+            if len(value) > MAX_SPECIFIC_LENGTH:
+                errors.append(f"Wert '{value}' für '{name}' ist länger als {MAX_SPECIFIC_LENGTH} Zeichen")
+
+        # Eigene Specifics ohne Vorgaben der Kategorie sind erlaubt
+        rules = allowed.get(name)
+        if not rules:
+            continue
+
+        if len(values) > rules['MaxValues']:
+            errors.append(f"'{name}' hat {len(values)} Werte, erlaubt sind {rules['MaxValues']}")
+        if rules['SelectionMode'] == 'SelectionOnly':
+            for value in values:
+                if value not in rules['Values']:
+                    errors.append(f"Wert '{value}' ist für '{name}' nicht erlaubt")
+
+    for name, rules in allowed.items():
+        if rules['UsageConstraint'] == 'Required' and name not in present:
+            errors.append(f"Pflichtangabe '{name}' fehlt")
+
+    return errors
+
+def validate_compatibility_list(category_id, compatibility_list, force_refresh=False):
+    """
+    Prüft eine Fahrzeugkompatibilitätsliste (Liste von Dictionaries Name -> Wert, wie von
+    extract_compatibility_list) gegen die Kompatibilitätseigenschaften der Kategorie.
+
+    Returns:
+        Liste mit Fehlermeldungen, leer wenn alles gültig ist
+    """
+    metadata = get_category_metadata(category_id, force_refresh)
+    if not metadata or not compatibility_list:
+        return []
+
+    properties = metadata.get('CompatibilityProperties')
+    if properties is None:
+        return []
+    if not properties:
+        return [f"Kategorie {category_id} unterstützt keine Fahrzeugkompatibilität"]
+
+    errors = []
+    for index, vehicle in enumerate(compatibility_list, start=1):
+        for name in vehicle:
+            if name != 'Notes' and name not in properties:
+                errors.append(f"Fahrzeug {index}: Eigenschaft '{name}' ist in der Kategorie nicht bekannt")
+    return errors
+
+def check_item_specifics(category_id, item_specifics):
+    """
+    Prüft die Item-Specifics vor einem Schreibaufruf.
+
+    Bei Fehlern wird einmal mit frisch geladenen Metadaten geprüft, da der Cache veraltet
+    sein kann. Bleiben Fehler bestehen, entscheidet der Benutzer, ob trotzdem gesendet wird.
+
+    Returns:
+        True, wenn der Artikel an eBay gesendet werden soll
+    """
+    errors = validate_item_specifics(category_id, item_specifics)
+    if errors:
+        errors = validate_item_specifics(category_id, item_specifics, force_refresh=True)
+    if not errors:
+        return True
+
+    print("Ungültige Item-Specifics:")
+    for error in errors:
+        print(f"  - {error}")
+    answer = input("Trotzdem an eBay senden? (j/n): ")
+    return answer.strip().lower() == "j"
+
+def check_compatibility_list(category_id, compatibility_list):
+    """
+    Prüft die Fahrzeugkompatibilitätsliste vor einem Schreibaufruf, analog zu
+    check_item_specifics.
+
+    Returns:
+        True, wenn die Liste an eBay gesendet werden soll
+    """
+    errors = validate_compatibility_list(category_id, compatibility_list)
+    if errors:
+        errors = validate_compatibility_list(category_id, compatibility_list, force_refresh=True)
+    if not errors:
+        return True
+
+    print("Ungültige Fahrzeugkompatibilitätsliste:")
+    for error in errors:
+        print(f"  - {error}")
+    answer = input("Trotzdem an eBay senden? (j/n): ")
+    return answer.strip().lower() == "j"
+
 def create_item_specifics_html(item):
     """Erstellt HTML-Tabelle für die Item-Specifics."""
     if not item or not hasattr(item, 'ItemSpecifics'):
@@ -219,6 +475,121 @@ def create_compatibility_html(compatibility_list):
     html_output += "</table>"
     return html_output
 
+def normalize_item_specifics(item):
+    """Wandelt die Item-Specifics in eine Liste aus [Name, [Werte]]-Paaren für den Cache-Schlüssel um."""
+    if not item or not hasattr(item, 'ItemSpecifics'):
+        return None
+    
+    normalized = []
+    for spec in item.ItemSpecifics.NameValueList:
+        values = spec.Value if isinstance(spec.Value, list) else [spec.Value]
+        normalized.append([str(spec.Name), [str(v) for v in values]])
+    return normalized
+
+def get_render_cache_key(template, title, picture_url, item_specifics, compatibility_list):
+    """
+    Bildet den Cache-Schlüssel für eine gerenderte Beschreibung.
+    
+    Der Schlüssel ist ein SHA-256-Hash über das Template (als Version) und alle
+    Eingabedaten, sodass jede Änderung automatisch zu einem neuen Eintrag führt.
+    Die Kompatibilitätsliste wird sortiert, da create_compatibility_html ohnehin
+    gruppiert und sortiert und die Reihenfolge das Ergebnis nicht beeinflusst.
+    """
+    if compatibility_list:
+        compatibility_list = sorted(compatibility_list, key=lambda vehicle: json.dumps(
+            vehicle, sort_keys=True, ensure_ascii=False, default=str))
+    
+    payload = json.dumps({
+        'title': title,
+        'picture_url': picture_url,
+        'item_specifics': item_specifics,
+        'compatibility': compatibility_list
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    
+    digest = hashlib.sha256()
+    digest.update(template.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(payload.encode("utf-8"))
+    return digest.hexdigest()
+
+def get_cached_rendering(cache_key):
+    """Sucht eine gerenderte Beschreibung zuerst im Speicher, dann optional auf der Festplatte."""
+    if cache_key in _render_cache:
+        _render_cache.move_to_end(cache_key)
+        return _render_cache[cache_key]
+    
+    if not RENDER_CACHE_DIR:
+        return None
+    
+    file_name = os.path.join(RENDER_CACHE_DIR, f"{cache_key}.html")
+    if not os.path.exists(file_name):
+        return None
+    
+    try:
+        with open(file_name, "r", encoding="utf-8") as f:
+            rendered = f.read()
+        # Zugriffszeit vermerken, damit häufig genutzte Einträge nicht verdrängt werden
+        os.utime(file_name)
+    except Exception as e:
+        print(f"Fehler beim Laden aus dem Beschreibungs-Cache: {e}")
+        return None
+    
+    store_rendering(cache_key, rendered, write_to_disk=False)
+    return rendered
+
+def store_rendering(cache_key, rendered, write_to_disk=True):
+    """Legt eine gerenderte Beschreibung im Cache ab und verdrängt die ältesten Einträge."""
+    _render_cache[cache_key] = rendered
+    _render_cache.move_to_end(cache_key)
+    while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+        _render_cache.popitem(last=False)
+    
+    if not write_to_disk or not RENDER_CACHE_DIR:
+        return
+    
+    # Erst in eine temporäre Datei schreiben und dann umbenennen, damit unter dem
+    # Hash-Schlüssel nie eine halb geschriebene Beschreibung liegt
+    temp_name = None
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=RENDER_CACHE_DIR, prefix="render_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(rendered)
+        os.replace(temp_name, os.path.join(RENDER_CACHE_DIR, f"{cache_key}.html"))
+    except Exception as e:
+        print(f"Fehler beim Speichern im Beschreibungs-Cache: {e}")
+        if temp_name and os.path.exists(temp_name):
+            os.remove(temp_name)
+        return
+    
+    prune_render_cache_dir()
+
+def prune_render_cache_dir():
+    """
+    Löscht die am längsten nicht genutzten Dateien, wenn der Datei-Cache zu groß wird.
+    
+    Berücksichtigt werden nur Cache-Einträge (<SHA-256>.html) und liegengebliebene
+    temporäre Dateien abgebrochener Schreibvorgänge, damit andere Dateien im
+    Verzeichnis (z. B. Template oder erzeugte Listings) erhalten bleiben.
+    """
+    try:
+        paths = []
+        for name in os.listdir(RENDER_CACHE_DIR):
+            path = os.path.join(RENDER_CACHE_DIR, name)
+            if re.fullmatch(r"[0-9a-f]{64}\.html", name):
+                paths.append(path)
+            elif (re.fullmatch(r"render_.*\.tmp", name)
+                  and time.time() - os.path.getmtime(path) > RENDER_CACHE_TEMP_MAX_AGE):
+                os.remove(path)
+        if len(paths) <= RENDER_CACHE_MAX_FILES:
+            return
+        
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - RENDER_CACHE_MAX_FILES]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Fehler beim Aufräumen des Beschreibungs-Caches: {e}")
+
 def generate_ebay_listing_html(item_id):
     """Hauptfunktion zum Erstellen einer HTML-Vorlage für den eBay-Artikel."""
     # Template-Datei laden
@@ -237,14 +608,24 @@ def generate_ebay_listing_html(item_id):
     # Daten extrahieren
     title = extract_title(item_details) or "Produkttitel nicht verfügbar"
     picture_url = extract_picture_url(item_details) or ""
-    item_specifics_html = create_item_specifics_html(item_details)
-    compatibility_html = create_compatibility_html(extract_compatibility_list(item_details))
+    compatibility_list = extract_compatibility_list(item_details)
     
-    # Template mit Daten füllen
-    filled_template = template.replace("{{TITLE}}", html.escape(title))
-    filled_template = filled_template.replace("{{PICTURE_URL}}", picture_url)
-    filled_template = filled_template.replace("{{ITEMSPEZIFIKATIONEN}}", item_specifics_html)
-    filled_template = filled_template.replace("{{KOMPATIBILITÄT}}", compatibility_html)
+    # Bereits gerenderte Beschreibung wiederverwenden, wenn sich nichts geändert hat
+    cache_key = get_render_cache_key(template, title, picture_url,
+                                     normalize_item_specifics(item_details), compatibility_list)
+    filled_template = get_cached_rendering(cache_key)
+    
+    if filled_template is None:
+        item_specifics_html = create_item_specifics_html(item_details)
+        compatibility_html = create_compatibility_html(compatibility_list)
+        
+        # Template mit Daten füllen
+        filled_template = template.replace("{{TITLE}}", html.escape(title))
+        filled_template = filled_template.replace("{{PICTURE_URL}}", picture_url)
+        filled_template = filled_template.replace("{{ITEMSPEZIFIKATIONEN}}", item_specifics_html)
+        filled_template = filled_template.replace("{{KOMPATIBILITÄT}}", compatibility_html)
+        
+        store_rendering(cache_key, filled_template)
     
     # Ausgabedatei erstellen
     output_filename = f"ebay_listing_{item_id}.html"
@@ -348,8 +729,11 @@ def create_new_item_draft(source_item_id, start_price=None, quantity=None, SKU=N
     final_sku = SKU if SKU is not None else f"COPY-{source_item_id}-{int(time.time())}"
     
     
-    # ItemSpecifics extrahieren
+    # ItemSpecifics extrahieren und vor dem API-Aufruf prüfen
     item_specifics = extract_item_specific(source_item)
+    if not check_item_specifics(category_id, item_specifics):
+        print("Artikel wird nicht erstellt.")
+        return None
 
     #item_compatibility_list = extract_compatibility_list(source_item) 
     #print(item_compatibility_list)
@@ -463,8 +847,11 @@ def revise_item(item_id, source_item_id, start_price=None, quantity=None, SKU=No
     final_quantity = quantity if quantity is not None else int(existing_item.Quantity)
     final_sku = SKU if SKU is not None else existing_item.SKU if hasattr(existing_item, 'SKU') else None
     
-    # ItemSpecifics extrahieren
+    # ItemSpecifics extrahieren und vor dem API-Aufruf prüfen
     item_specifics = extract_item_specific(source_item)
+    if not check_item_specifics(category_id, item_specifics):
+        print("Artikel wird nicht überarbeitet.")
+        return None
 
     # Benutzer nach Gewicht fragen
     weight = input("Bitte geben Sie das Gewicht des Artikels in kg ein: ")
@@ -519,6 +906,25 @@ EBAY_API_CONFIG = {
     'sandbox': False
 }
 
+# OAuth-Token für die Taxonomy-API (optional, für Kompatibilitätseigenschaften)
+EBAY_OAUTH_TOKEN = os.getenv('EBAY_OAUTH_TOKEN')
+TAXONOMY_API_TIMEOUT = 30  # Sekunden
+
+# Cache für Kategorie-Metadaten (Item-Specifics, Kompatibilitätseigenschaften)
+CATEGORY_CACHE_DIR = "category_cache"
+CATEGORY_CACHE_MAX_AGE = 24 * 60 * 60  # Sekunden
+MAX_SPECIFIC_LENGTH = 65
+_category_metadata_cache = {}
+_refreshed_categories = set()
+_category_version = None
+
+# Cache für gerenderte HTML-Beschreibungen; RENDER_CACHE_DIR aktiviert zusätzlich einen Datei-Cache
+RENDER_CACHE_MAX_ENTRIES = 128
+RENDER_CACHE_MAX_FILES = 1000
+RENDER_CACHE_TEMP_MAX_AGE = 60 * 60  # Sekunden, danach gelten temporäre Dateien als verwaist
+RENDER_CACHE_DIR = os.getenv('EBAY_RENDER_CACHE_DIR')
+_render_cache = OrderedDict()
+
 # Hauptprogramm
 if __name__ == "__main__":
     print("eBay Artikelkopierer")